@@ -1,10 +1,14 @@
 import os
 from flask import Flask, render_template, request, send_file
 from werkzeug.utils import secure_filename
-from report_logic import generate_report_pdf, ensure_image_resized
-from io import BytesIO
-import pandas as pd
-import time
+from report_logic import generate_report_pdf, ensure_image_resized, upload_digest
+import tempfile
+from python_calamine import CalamineWorkbook
+import re
+import posixpath
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import xml.etree.ElementTree as ET
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = 'uploads'
@@ -12,40 +16,175 @@ os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
 ALLOWED_IMAGE_EXTS = {'png', 'jpg', 'jpeg', 'gif'}
 ALLOWED_EXCEL_EXTS = {'xlsx'}
+PDF_SPOOL_MAX = 4 * 1024 * 1024  # larger reports spill to disk
+SAVE_WORKERS = 8  # uploads per POST are few and I/O-bound
+ATTENDANCE_HEADERS = frozenset({'name', 'names', 'participant', 'participant name'})
+ATTENDANCE_SPLIT = re.compile(r'[\r\n,]+')
+XLSX_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+XLSX_REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
 
 def allowed_file(filename, allowed_set):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in allowed_set
 
 def save_uploaded_file(fileobj, subfolder=None):
+    """
+    Save an upload under its content hash and return (path, content digest),
+    or (None, None) if there is nothing to save. The bytes are hashed while
+    streaming to a temp file, which is then renamed to <digest><ext>; if that
+    file already exists (same content uploaded before) the temp file is
+    dropped and the existing one, likely still in the page cache, is reused.
+    """
     if not fileobj:
-        return None
+        return None, None
     filename = secure_filename(fileobj.filename)
     if filename == '':
-        return None
-    # add timestamp to avoid collisions
-    ts = int(time.time() * 1000)
-    name = f"{ts}_{filename}"
+        return None, None
+    ext = os.path.splitext(filename)[1].lower()
     dest_dir = app.config['UPLOAD_FOLDER'] if not subfolder else os.path.join(app.config['UPLOAD_FOLDER'], subfolder)
     os.makedirs(dest_dir, exist_ok=True)
-    path = os.path.join(dest_dir, name)
-    fileobj.save(path)
-    return path
+    h = upload_digest()
+    out = tempfile.NamedTemporaryFile(dir=dest_dir, suffix='.part', delete=False)
+    try:
+        with out:
+            for chunk in iter(lambda: fileobj.stream.read(64 * 1024), b''):
+                h.update(chunk)
+                out.write(chunk)
+        digest = h.hexdigest()
+        path = os.path.join(dest_dir, f"{digest}{ext}")
+        if os.path.exists(path):
+            os.remove(out.name)
+        else:
+            os.replace(out.name, path)
+    except Exception:
+        # don't leave partial uploads behind
+        if os.path.exists(out.name):
+            os.remove(out.name)
+        raise
+    return path, digest
+
+def save_uploaded_files(uploads):
+    """
+    Save {key: (fileobj, subfolder)} uploads on a thread pool, so the disk
+    writes overlap. Returns {key: (path, digest)}.
+    """
+    if not uploads:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(len(uploads), SAVE_WORKERS)) as ex:
+        futures = {ex.submit(save_uploaded_file, f, subfolder): key for key, (f, subfolder) in uploads.items()}
+        return {futures[fut]: fut.result() for fut in as_completed(futures)}
+
+def resize_images(uploads):
+    """
+    Run ensure_image_resized over (path, digest) pairs on a thread pool
+    (Pillow releases the GIL while decoding and resampling). Returns its
+    (path, img_bytes, size) results in the input order.
+    """
+    if not uploads:
+        return []
+    workers = min(len(uploads), os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        return list(ex.map(lambda u: ensure_image_resized(*u), uploads))
+
+def xlsx_text(elem):
+    # <si>/<is> hold either a plain <t> or rich-text runs <r><t>
+    t = elem.find(XLSX_NS + 't')
+    if t is not None:
+        return t.text or ''
+    return ''.join(r.findtext(XLSX_NS + 't') or '' for r in elem.findall(XLSX_NS + 'r'))
+
+def xlsx_first_sheet_part(zf):
+    # The first sheet is the first <sheet> in workbook.xml; its part name comes from
+    # the workbook rels (Excel keeps part names like sheet1.xml when sheets are reordered)
+    with zf.open('xl/workbook.xml') as fh:
+        sheet = ET.parse(fh).find(f'{XLSX_NS}sheets/{XLSX_NS}sheet')
+    rid = sheet.get(XLSX_REL_NS + 'id')
+    with zf.open('xl/_rels/workbook.xml.rels') as fh:
+        rels = ET.parse(fh).getroot()
+    target = next(rel.get('Target') for rel in rels if rel.get('Id') == rid)
+    if target.startswith('/'):
+        return target.lstrip('/')
+    return posixpath.normpath(posixpath.join('xl', target))
+
+def read_xlsx_first_column(path):
+    """
+    Read the non-empty cells of column A of the first sheet straight from the
+    XLSX zip, skipping style and theme parsing. Raises on anything unexpected
+    so the caller can fall back to a full reader.
+    Cell number formats are not read, so date cells come back as their serial
+    number (e.g. '45659') rather than a date.
+    """
+    with zipfile.ZipFile(path) as zf:
+        sheet_part = xlsx_first_sheet_part(zf)
+        shared = []
+        if 'xl/sharedStrings.xml' in zf.namelist():
+            with zf.open('xl/sharedStrings.xml') as fh:
+                for _, elem in ET.iterparse(fh):
+                    if elem.tag == XLSX_NS + 'si':
+                        shared.append(xlsx_text(elem))
+                        elem.clear()
+        values = []
+        col = 0  # 1-based column of the current cell within its row
+        with zf.open(sheet_part) as fh:
+            for _, elem in ET.iterparse(fh):
+                if elem.tag == XLSX_NS + 'row':
+                    elem.clear()
+                    col = 0
+                    continue
+                if elem.tag != XLSX_NS + 'c':
+                    continue
+                # r="B7" is optional; without it a cell follows the previous one
+                ref = elem.get('r')
+                if ref:
+                    letters = ref.rstrip('0123456789')
+                    col = 0
+                    for ch in letters:
+                        col = col * 26 + ord(ch) - 64
+                else:
+                    col += 1
+                if col == 1:
+                    kind = elem.get('t')
+                    if kind == 'inlineStr':
+                        is_elem = elem.find(XLSX_NS + 'is')
+                        if is_elem is not None:
+                            values.append(xlsx_text(is_elem))
+                    else:
+                        v = elem.findtext(XLSX_NS + 'v')
+                        if v is not None:
+                            if kind == 's':
+                                v = shared[int(v)]
+                            elif kind == 'b':
+                                # match calamine/pandas, which return a bool
+                                v = 'True' if v == '1' else 'False'
+                            values.append(v)
+                elem.clear()
+        return values
+
+def read_excel_first_column(path):
+    # Full reader: stream rows of the first sheet with calamine (Rust)
+    values = []
+    for row in CalamineWorkbook.from_path(path).get_sheet_by_index(0).iter_rows():
+        if not row or row[0] is None:
+            continue
+        cell = row[0]
+        # calamine returns every number as float; keep IDs like 2341001 intact
+        if isinstance(cell, float) and cell.is_integer():
+            cell = int(cell)
+        values.append(cell)
+    return values
 
 def parse_attendance_excel(path):
-    # Use pandas to read first column of first sheet
     try:
-        df = pd.read_excel(path, engine='openpyxl')
-        # if dataframe has no columns (rare), try to read as values
-        if df.shape[1] == 0:
-            return []
-        # pick first column
-        first_col = df.iloc[:, 0].dropna().astype(str).tolist()
-        # If header-like values present e.g. "Name", drop it if all rows below are names
-        if len(first_col) > 0 and first_col[0].strip().lower() in ['name', 'names', 'participant', 'participant name']:
+        try:
+            first_col = read_xlsx_first_column(path)
+        except Exception as e:
+            print("Fast xlsx read failed, falling back:", e)
+            first_col = read_excel_first_column(path)
+        # strip whitespace and filter empties in one pass, stripping each cell once
+        first_col = [s for v in first_col if (s := str(v).strip())]
+        # If header-like values present e.g. "Name", drop it
+        if len(first_col) > 0 and first_col[0].lower() in ATTENDANCE_HEADERS:
             first_col = first_col[1:]
-        # strip whitespace and filter empties
-        cleaned = [s.strip() for s in first_col if s.strip()]
-        return cleaned
+        return first_col
     except Exception as e:
         print("Error parsing excel:", e)
         return []
@@ -53,21 +192,8 @@ def parse_attendance_excel(path):
 def parse_attendance_text(text):
     if not text:
         return []
-    # split by newlines or commas
-    parts = []
-    for line in text.splitlines():
-        line = line.strip()
-        if not line:
-            continue
-        # if multiple names in line separated by commas
-        if ',' in line:
-            for p in line.split(','):
-                p = p.strip()
-                if p:
-                    parts.append(p)
-        else:
-            parts.append(line)
-    return parts
+    # split by newlines or commas in one C-level pass
+    return [p for p in (s.strip() for s in ATTENDANCE_SPLIT.split(text)) if p]
 
 @app.route('/', methods=['GET', 'POST'])
 def index():
@@ -116,76 +242,85 @@ def index():
                 'caption': request.form.get('caption', '')
             }
 
-            # Speaker image
+            # Uploads are saved concurrently, then the images are resized as one parallel batch.
+            # keys: 'speaker', 'flyer', 'approval', 'impact', ('photo', i), ('feedback', i), 'attendance'
+            uploads = {}
             speaker_file = request.files.get('speaker_image')
             if speaker_file and allowed_file(speaker_file.filename, ALLOWED_IMAGE_EXTS):
-                p = save_uploaded_file(speaker_file, subfolder='speaker')
-                # resize and return path to resized image
-                p2 = ensure_image_resized(p)
-                data['speaker_profile']['image_path'] = p2
-            else:
-                data['speaker_profile']['image_path'] = None
+                uploads['speaker'] = (speaker_file, 'speaker')
 
             # Activity photos (up to 5)
-            photo_paths = []
             for i in range(1, 6):
                 f = request.files.get(f'photo_{i}')
                 if f and allowed_file(f.filename, ALLOWED_IMAGE_EXTS):
-                    p = save_uploaded_file(f, subfolder='photos')
-                    p2 = ensure_image_resized(p)
-                    photo_paths.append(p2)
-            data['photos']['image_paths'] = photo_paths
+                    uploads[('photo', i)] = (f, 'photos')
+
+            # Flyer, Approval, Impact - images only
+            for key, field in (('flyer', 'flyer'), ('approval', 'approval_letter'), ('impact', 'impact_analysis_report')):
+                f = request.files.get(field)
+                if f and allowed_file(f.filename, ALLOWED_IMAGE_EXTS):
+                    uploads[key] = (f, 'attachments')
+
+            # Feedback screenshots up to 5
+            for i in range(1, 6):
+                f = request.files.get(f'feedback_ss_{i}')
+                if f and allowed_file(f.filename, ALLOWED_IMAGE_EXTS):
+                    uploads[('feedback', i)] = (f, 'feedback')
+
+            attendance_excel = request.files.get('attendance_excel')
+            if attendance_excel and allowed_file(attendance_excel.filename, ALLOWED_EXCEL_EXTS):
+                uploads['attendance'] = (attendance_excel, 'attendance')
+
+            # (path, digest) per key
+            image_uploads = save_uploaded_files(uploads)
+            excel_path, _ = image_uploads.pop('attendance', (None, None))
+
+            keys = list(image_uploads)
+            resized = {}
+            data['images'] = {}
+            for key, (path, img_bytes, size) in zip(keys, resize_images([image_uploads[k] for k in keys])):
+                resized[key] = path
+                if img_bytes:
+                    data['images'][path] = (img_bytes, size)
+
+            data['speaker_profile']['image_path'] = resized.get('speaker')
+            data['photos']['image_paths'] = [resized[('photo', i)] for i in range(1, 6) if ('photo', i) in resized]
+            data['flyer_path'] = resized.get('flyer')
+            data['approval_path'] = resized.get('approval')
+            data['impact_path'] = resized.get('impact')
+            data['feedback_screenshots'] = [resized[('feedback', i)] for i in range(1, 6) if ('feedback', i) in resized]
 
             # Attendance: manual text + excel (excel overrides if provided)
             attendance_manual = request.form.get('attendance_text', '')
             attendance_list = parse_attendance_text(attendance_manual)
 
-            attendance_excel = request.files.get('attendance_excel')
-            if attendance_excel and allowed_file(attendance_excel.filename, ALLOWED_EXCEL_EXTS):
-                excel_path = save_uploaded_file(attendance_excel, subfolder='attendance')
+            if excel_path:
                 parsed = parse_attendance_excel(excel_path)
                 if parsed:
                     attendance_list = parsed  # excel takes precedence if parsed names exist
 
             data['attendance'] = attendance_list
 
-            # Flyer, Approval, Impact - images only
-            flyer = request.files.get('flyer')
-            data['flyer_path'] = None
-            if flyer and allowed_file(flyer.filename, ALLOWED_IMAGE_EXTS):
-                p = save_uploaded_file(flyer, subfolder='attachments')
-                data['flyer_path'] = ensure_image_resized(p)
-
-            approval = request.files.get('approval_letter')
-            data['approval_path'] = None
-            if approval and allowed_file(approval.filename, ALLOWED_IMAGE_EXTS):
-                p = save_uploaded_file(approval, subfolder='attachments')
-                data['approval_path'] = ensure_image_resized(p)
-
-            impact = request.files.get('impact_analysis_report')
-            data['impact_path'] = None
-            if impact and allowed_file(impact.filename, ALLOWED_IMAGE_EXTS):
-                p = save_uploaded_file(impact, subfolder='attachments')
-                data['impact_path'] = ensure_image_resized(p)
+            # Generate the PDF into one buffer: kept in memory up to PDF_SPOOL_MAX,
+            # spilled to a temp file beyond that; send_file closes it after streaming
+            buf = tempfile.SpooledTemporaryFile(max_size=PDF_SPOOL_MAX)
+            try:
+                generate_report_pdf(data, buf)
+                size = buf.tell()
+                buf.seek(0)
 
-            # Feedback screenshots up to 5
-            fb_paths = []
-            for i in range(1, 6):
-                f = request.files.get(f'feedback_ss_{i}')
-                if f and allowed_file(f.filename, ALLOWED_IMAGE_EXTS):
-                    p = save_uploaded_file(f, subfolder='feedback')
-                    fb_paths.append(ensure_image_resized(p))
-            data['feedback_screenshots'] = fb_paths
-
-            # Generate PDF bytes
-            pdf_bytes = generate_report_pdf(data)
-
-            return send_file(
-                BytesIO(pdf_bytes),
-                mimetype='application/pdf',
-                as_attachment=True,
-                download_name=f"{data['general_info'].get('Title of the Activity','Activity')}_Report.pdf"
-            )
+                resp = send_file(
+                    buf,
+                    mimetype='application/pdf',
+                    as_attachment=True,
+                    download_name=f"{data['general_info'].get('Title of the Activity','Activity')}_Report.pdf"
+                )
+            except Exception:
+                # send_file never took ownership; release a spilled temp file now
+                buf.close()
+                raise
+            resp.content_length = size
+            return resp
 
         except Exception as exc:
             print("Exception in POST:", exc)
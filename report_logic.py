@@ -1,57 +1,158 @@
 import os
+import hashlib
+import tempfile
+from functools import lru_cache
 from io import BytesIO
-from reportlab.lib.pagesizes import A4
+from xml.sax.saxutils import escape
 from reportlab.lib.units import inch
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Image, PageBreak
-from reportlab.lib import colors
-from PIL import Image as PILImage
+from reportlab.lib.pagesizes import A4
+import imagesize
+
+# ReportLab's platypus/styles and PIL are heavy imports (PIL pulls in numpy when present);
+# they are imported inside the functions below so GET requests and idle workers never load them.
 
 # Config
 MAX_IMAGE_WIDTH_INCH = 6.6  # max width in inches for images in PDF
-MAX_IMAGE_PX = 1200         # max pixel width we will resize images to (approx)
+MAX_IMAGE_PX = 1000         # max pixel width we will resize images to (~150 DPI at 6.6in)
+IDCT_SNAP_MIN = 0.8         # JPEGs may be downscaled by draft() alone to >= 80% of MAX_IMAGE_PX
+PAGE_MARGIN = 0.7*inch       # all four page margins
+FRAME_PADDING = 6            # SimpleDocTemplate's default frame padding on each side, in points
+# tallest image that fits the A4 frame; taller ones make doc.build raise LayoutError
+MAX_IMAGE_HEIGHT_PTS = A4[1] - 2*PAGE_MARGIN - 2*FRAME_PADDING
 UPLOADS_DIR = "uploads"
+RESIZED_CACHE_DIR = os.path.join(UPLOADS_DIR, ".cache")
 
-styles = getSampleStyleSheet()
 BASE_FONT = "Times-Roman"
 BOLD_FONT = "Times-Bold"
 
-# Paragraph styles
-styles.add(ParagraphStyle(name='HeaderMain', fontName=BOLD_FONT, fontSize=16, alignment=1, spaceAfter=8))
-styles.add(ParagraphStyle(name='HeaderSub', fontName=BASE_FONT, fontSize=10, alignment=1, spaceAfter=4))
-styles.add(ParagraphStyle(name='ReportTitle', fontName=BOLD_FONT, fontSize=12, alignment=1, spaceAfter=12))
-styles.add(ParagraphStyle(name='SectionTitle', fontName=BOLD_FONT, fontSize=10, alignment=0, spaceBefore=14, spaceAfter=6))
-styles.add(ParagraphStyle(name='NormalText', fontName=BASE_FONT, fontSize=10, leading=14))
-styles.add(ParagraphStyle(name='TableKey', fontName=BOLD_FONT, fontSize=10, leading=12))
-styles.add(ParagraphStyle(name='TableValue', fontName=BASE_FONT, fontSize=10, leading=12))
+@lru_cache(maxsize=None)
+def get_styles():
+    """
+    Build the paragraph stylesheet on first use.
+    """
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    styles = getSampleStyleSheet()
+    # Paragraph styles
+    styles.add(ParagraphStyle(name='HeaderMain', fontName=BOLD_FONT, fontSize=16, alignment=1, spaceAfter=8))
+    styles.add(ParagraphStyle(name='HeaderSub', fontName=BASE_FONT, fontSize=10, alignment=1, spaceAfter=4))
+    styles.add(ParagraphStyle(name='ReportTitle', fontName=BOLD_FONT, fontSize=12, alignment=1, spaceAfter=12))
+    styles.add(ParagraphStyle(name='SectionTitle', fontName=BOLD_FONT, fontSize=10, alignment=0, spaceBefore=14, spaceAfter=6))
+    styles.add(ParagraphStyle(name='NormalText', fontName=BASE_FONT, fontSize=10, leading=14))
+    styles.add(ParagraphStyle(name='TableKey', fontName=BOLD_FONT, fontSize=10, leading=12))
+    styles.add(ParagraphStyle(name='TableValue', fontName=BASE_FONT, fontSize=10, leading=12))
+    return styles
+
+def upload_digest():
+    # 128-bit content hash used to key the resized-image cache
+    return hashlib.blake2b(digest_size=16)
+
+def resized_cache_path(digest, ext):
+    """
+    Return the cache location for the resized copy of an upload whose bytes
+    hash to `digest`.
+    """
+    # the target width is part of the key so changing MAX_IMAGE_PX invalidates old entries
+    return os.path.join(RESIZED_CACHE_DIR, f"{digest}_{MAX_IMAGE_PX}{ext.lower()}")
+
+def read_file_bytes(path):
+    with open(path, 'rb') as fh:
+        return fh.read()
 
-def ensure_image_resized(path):
+def ensure_image_resized(path, digest=None):
     """
-    Resize image if it's very large. Save a resized copy with suffix _resized
-    and return the resized path (or original path if small).
+    Resize image if it's very large, and apply its EXIF orientation (ReportLab
+    embeds pixels as stored and ignores the tag, so phone photos come out
+    sideways otherwise). PNGs are always re-encoded as JPEG, flattened onto
+    white if they have transparency: ReportLab would otherwise re-compress
+    their pixels with Flate, which is slower and several times larger.
+    The result is stored in the cache under the upload's content hash, so
+    re-uploading the same file reuses it.
+    Returns (path, encoded image bytes, (width_px, height_px)): the resized
+    path (or original path if small, upright and not PNG) plus its contents
+    and pixel size, so the PDF step neither reads nor probes the file again.
+    Bytes and size are None if the image could not be read.
     """
+    if not path or not os.path.exists(path):
+        return path, None, None
     try:
+        # header-only probe; skip the full decode when nothing needs doing.
+        # width/height are as displayed, i.e. after the EXIF rotation
+        ext = os.path.splitext(path)[1]
+        to_jpeg = ext.lower() == '.png'
+        info = imagesize.get_info(path, dpi=False, colors=False, channels=False)
+        upright = info.rotation in (-1, 1)
+        if upright and not to_jpeg and 0 <= info.width <= MAX_IMAGE_PX:
+            return path, read_file_bytes(path), (info.width, info.height)
+        if digest is None:
+            h = upload_digest()
+            with open(path, 'rb') as fh:
+                for chunk in iter(lambda: fh.read(64 * 1024), b''):
+                    h.update(chunk)
+            digest = h.hexdigest()
+        out_ext = '.jpg' if to_jpeg else ext
+        cache_path = resized_cache_path(digest, out_ext)
+        if os.path.exists(cache_path):
+            return cache_path, read_file_bytes(cache_path), imagesize.get(cache_path, exif_rotation=False)
+        from PIL import Image as PILImage, ImageOps
         img = PILImage.open(path)
-        w, h = img.size
-        if w > MAX_IMAGE_PX:
-            ratio = MAX_IMAGE_PX / float(w)
-            new_w = int(w * ratio)
-            new_h = int(h * ratio)
-            img = img.resize((new_w, new_h), PILImage.LANCZOS)
-            base, ext = os.path.splitext(path)
-            new_path = f"{base}_resized{ext}"
-            img.save(new_path, quality=85)
-            return new_path
+        fmt = img.format
+        orientation = img.getexif().get(0x0112, 1)
+        # orientations 5-8 rotate by 90 degrees, so the displayed width is the stored height
+        swapped = orientation in (5, 6, 7, 8)
+        w = img.size[1] if swapped else img.size[0]
+        if w > MAX_IMAGE_PX or orientation != 1 or to_jpeg:
+            if fmt == 'JPEG' and w > MAX_IMAGE_PX:
+                # let libjpeg decode at 1/2, 1/4 or 1/8 scale instead of full size.
+                # if one of those scales lands just under MAX_IMAGE_PX, snap to it so
+                # the decode is the whole downscale; otherwise stay above it for LANCZOS
+                target = MAX_IMAGE_PX
+                for k in (8, 4, 2):
+                    if MAX_IMAGE_PX * IDCT_SNAP_MIN <= w / k <= MAX_IMAGE_PX:
+                        target = w // k
+                        break
+                img.draft('RGB', (1, target) if swapped else (target, 1))
+            # C-level transpose/rotate; no per-pixel Python work
+            ImageOps.exif_transpose(img, in_place=True)
+            if img.size[0] > MAX_IMAGE_PX:
+                img.thumbnail((MAX_IMAGE_PX, 65536), PILImage.LANCZOS)
+            if to_jpeg:
+                if img.mode in ('RGBA', 'LA') or 'transparency' in img.info:
+                    rgba = img.convert('RGBA')
+                    img = PILImage.new('RGB', rgba.size, 'white')
+                    img.paste(rgba, mask=rgba.split()[3])
+                elif img.mode not in ('RGB', 'L'):
+                    img = img.convert('RGB')
+                fmt = 'JPEG'
+            out = BytesIO()
+            if fmt == 'JPEG':
+                img.save(out, fmt, quality=85, optimize=True, progressive=True, subsampling='4:2:0')
+            else:
+                img.save(out, fmt, quality=85)
+            img_bytes = out.getvalue()
+            os.makedirs(RESIZED_CACHE_DIR, exist_ok=True)
+            # write to a temp file and rename, so concurrent identical uploads never see a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=RESIZED_CACHE_DIR, suffix=out_ext)
+            try:
+                with os.fdopen(fd, 'wb') as fh:
+                    fh.write(img_bytes)
+                os.replace(tmp_path, cache_path)
+            except Exception:
+                os.remove(tmp_path)
+                raise
+            return cache_path, img_bytes, img.size
         else:
-            return path
+            return path, read_file_bytes(path), img.size
     except Exception as e:
         print("Image resize error:", e)
-        return path
+        return path, None, None
 
 def make_table_from_dict(dct, colWidths=[2.2*inch, 4.8*inch]):
     """
     Create a Table flowable from a dictionary with consistent styling.
     """
+    from reportlab.platypus import Paragraph, Spacer, Table, TableStyle
+    from reportlab.lib import colors
+    styles = get_styles()
     if not dct:
         return []
     data = []
@@ -77,39 +178,63 @@ def participant_table(names):
     """
     Create a table with a single column 'Participant Name' with each name on its own row.
     """
+    from reportlab.platypus import Paragraph, Spacer, Table, TableStyle
+    from reportlab.lib import colors
+    styles = get_styles()
     if not names:
         return [Paragraph("No attendance records provided.", styles['NormalText']), Spacer(1, 0.08*inch)]
-    data = [[Paragraph("Participant Name", styles['TableKey'])]]
-    for n in names:
-        data.append([Paragraph(n, styles['TableValue'])])
+    # Plain string cells skip Paragraph markup parsing; only names too wide for one
+    # line still get a (wrapping) Paragraph
+    from reportlab.pdfbase.pdfmetrics import stringWidth
+    value_style = styles['TableValue']
+    max_w = 6.8*inch - 12  # column width minus left/right padding
+    data = [["Participant Name"]] + [
+        [n if stringWidth(n, BASE_FONT, 10) <= max_w else Paragraph(escape(n), value_style)]
+        for n in names
+    ]
     tbl = Table(data, colWidths=[6.8*inch], hAlign='LEFT')
     tbl.setStyle(TableStyle([
         ('GRID', (0,0), (-1,-1), 0.75, colors.black),
         ('BACKGROUND', (0,0), (-1,0), colors.HexColor("#f0f0f0")),
         ('ALIGN', (0,0), (-1,0), 'LEFT'),
+        ('VALIGN', (0,0), (-1,-1), 'TOP'),
+        ('FONTNAME', (0,0), (-1,-1), BASE_FONT),
         ('FONTNAME', (0,0), (-1,0), BOLD_FONT),
+        ('FONTSIZE', (0,0), (-1,-1), 10),
+        ('LEADING', (0,0), (-1,-1), 12),
         ('LEFTPADDING', (0,0), (-1,-1), 6),
         ('RIGHTPADDING', (0,0), (-1,-1), 6),
     ]))
     return [tbl, Spacer(1, 0.12*inch)]
 
-def image_flowable(path, max_width_inch=MAX_IMAGE_WIDTH_INCH):
+def image_flowable(path, max_width_inch=MAX_IMAGE_WIDTH_INCH, image=None):
     """
-    Return a ReportLab Image flowable scaled to the given max width (keeps aspect ratio).
+    Return a ReportLab Image flowable scaled to the given max width and to the page
+    frame height (keeps aspect ratio).
+    `image` is the (bytes, (width_px, height_px)) pair from ensure_image_resized; when
+    given, the bytes are embedded from memory and the size is not probed again.
     """
-    if not path or not os.path.exists(path):
+    from reportlab.platypus import Paragraph, Image
+    styles = get_styles()
+    img_bytes, size = image if image else (None, None)
+    if not img_bytes and (not path or not os.path.exists(path)):
         return Paragraph(f"[Image not found: {path}]", styles['NormalText'])
     try:
         # ReportLab uses points; 1 inch = 72 points
         max_w_pts = max_width_inch * 72
-        # We can let ReportLab scale if we supply width only
-        img = Image(path)
-        iw, ih = img.drawWidth, img.drawHeight
-        # if width already larger than allowed, scale
-        if iw > max_w_pts:
-            scale = max_w_pts / iw
-            img.drawWidth = iw * scale
-            img.drawHeight = ih * scale
+        if img_bytes and size:
+            # ReportLab draws one pixel per point (useDPI is off)
+            w_px, h_px = size
+            scale = min(1, max_w_pts / w_px, MAX_IMAGE_HEIGHT_PTS / h_px)
+            img = Image(BytesIO(img_bytes), width=w_px * scale, height=h_px * scale)
+        else:
+            img = Image(path)
+            iw, ih = img.drawWidth, img.drawHeight
+            # if width or height already larger than allowed, scale
+            scale = min(1, max_w_pts / iw, MAX_IMAGE_HEIGHT_PTS / ih)
+            if scale < 1:
+                img.drawWidth = iw * scale
+                img.drawHeight = ih * scale
         # center
         img.hAlign = 'CENTER'
         return img
@@ -117,12 +242,32 @@ def image_flowable(path, max_width_inch=MAX_IMAGE_WIDTH_INCH):
         print("Error creating image flowable:", e)
         return Paragraph(f"[Failed to load image: {path}]", styles['NormalText'])
 
-def generate_report_pdf(data):
-    buf = BytesIO()
-    doc = SimpleDocTemplate(buf, pagesize=A4,
-                            leftMargin=0.7*inch, rightMargin=0.7*inch,
-                            topMargin=0.7*inch, bottomMargin=0.7*inch)
-    story = []
+def image_section(title, paths, empty_text, images):
+    """
+    Section title followed by each image (or a placeholder line if there are none).
+    `images` maps path -> (bytes, pixel size) as passed to image_flowable.
+    """
+    from reportlab.platypus import Paragraph, Spacer
+    styles = get_styles()
+    items = [Paragraph(title, styles['SectionTitle'])]
+    if not paths:
+        return items + [Paragraph(empty_text, styles['NormalText']), Spacer(1, 0.08*inch)]
+    for p in paths:
+        items += [image_flowable(p, image=images.get(p)), Spacer(1, 0.12*inch)]
+    return items
+
+def generate_report_pdf(data, out):
+    """
+    Write the report PDF into `out`, any writable binary stream. The caller
+    owns the stream, so the PDF is never copied into a second buffer.
+    """
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+    styles = get_styles()
+    doc = SimpleDocTemplate(out, pagesize=A4,
+                            leftMargin=PAGE_MARGIN, rightMargin=PAGE_MARGIN,
+                            topMargin=PAGE_MARGIN, bottomMargin=PAGE_MARGIN)
+    # (bytes, pixel size) of each resized image, keyed by path
+    images = data.get('images', {})
 
     # Header
     hdr = data.get('header', {})
@@ -130,28 +275,6 @@ def generate_report_pdf(data):
     school = hdr.get('school', '')
     department = hdr.get('department', '')
 
-    story.append(Paragraph(university, styles['HeaderMain']))  # 16pt bold centered
-    if school:
-        story.append(Paragraph(school, styles['HeaderSub']))
-    if department:
-        story.append(Paragraph(department, styles['HeaderSub']))
-    story.append(Spacer(1, 0.2*inch))
-    story.append(Paragraph("Activity Report", styles['ReportTitle']))
-
-    # General Info
-    story.append(Paragraph("General Information", styles['SectionTitle']))
-    story.extend(make_table_from_dict(data.get('general_info', {})))
-
-    # Speaker details
-    story.append(Paragraph("Speaker/Guest/Presenter Details", styles['SectionTitle']))
-    story.extend(make_table_from_dict(data.get('speaker_details', {})))
-
-    # Participants profile
-    story.append(Paragraph("Participants Profile", styles['SectionTitle']))
-    story.extend(make_table_from_dict(data.get('participants_profile', {})))
-
-    # Synopsis
-    story.append(Paragraph("Synopsis of the Activity (Description)", styles['SectionTitle']))
     synopsis = data.get('synopsis', {})
     synopsis_table = {
         "Highlights of the Activity (Description)": synopsis.get('highlights', ''),
@@ -159,83 +282,62 @@ def generate_report_pdf(data):
         "Summary of the Activity": synopsis.get('summary', ''),
         "Follow-up plan": synopsis.get('follow_up_plan', '')
     }
-    story.extend(make_table_from_dict(synopsis_table,))
-
-    # Report prepared by
-    story.append(Paragraph("Report Prepared By", styles['SectionTitle']))
-    story.extend(make_table_from_dict(data.get('report_prepared_by', {})))
 
-    # Speaker profile (text + image)
+    # Speaker profile (text + image), only if either is present
     sp = data.get('speaker_profile', {})
+    speaker_profile = []
     if sp and (sp.get('profile_text') or sp.get('image_path')):
-        story.append(Paragraph("Speaker Profile", styles['SectionTitle']))
+        speaker_profile.append(Paragraph("Speaker Profile", styles['SectionTitle']))
         if sp.get('profile_text'):
-            story.append(Paragraph(sp.get('profile_text', ''), styles['NormalText']))
-            story.append(Spacer(1, 0.08*inch))
+            speaker_profile += [Paragraph(sp.get('profile_text', ''), styles['NormalText']), Spacer(1, 0.08*inch)]
         if sp.get('image_path'):
-            story.append(image_flowable(sp.get('image_path')))
-            story.append(Spacer(1, 0.12*inch))
-
-    # Photos of Activity
-    photos = data.get('photos', {})
-    photo_list = photos.get('image_paths', [])
-    story.append(Paragraph("Photos of the Activity", styles['SectionTitle']))
-    if photo_list:
-        for p in photo_list:
-            story.append(image_flowable(p))
-            story.append(Spacer(1, 0.12*inch))
-    else:
-        story.append(Paragraph("No photos provided.", styles['NormalText']))
-        story.append(Spacer(1, 0.08*inch))
-
-    # Attendance List (neat table)
-    story.append(Paragraph("Attendance List", styles['SectionTitle']))
-    attendance = data.get('attendance', [])
-    story.extend(participant_table(attendance))
-
-    # Flyer of the Event
-    story.append(Paragraph("Flyer of the Event", styles['SectionTitle']))
-    flyer_path = data.get('flyer_path')
-    if flyer_path:
-        story.append(image_flowable(flyer_path))
-        story.append(Spacer(1, 0.12*inch))
-    else:
-        story.append(Paragraph("No flyer uploaded.", styles['NormalText']))
-        story.append(Spacer(1, 0.08*inch))
-
-    # Approval Letter
-    story.append(Paragraph("Approval Letter", styles['SectionTitle']))
-    approval_path = data.get('approval_path')
-    if approval_path:
-        story.append(image_flowable(approval_path))
-        story.append(Spacer(1, 0.12*inch))
-    else:
-        story.append(Paragraph("No approval letter uploaded.", styles['NormalText']))
-        story.append(Spacer(1, 0.08*inch))
-
-    # Feedback Screenshots (placed before Impact Analysis)
-    story.append(Paragraph("Feedback Screenshots", styles['SectionTitle']))
-    fb_list = data.get('feedback_screenshots', [])
-    if fb_list:
-        for p in fb_list:
-            story.append(image_flowable(p))
-            story.append(Spacer(1, 0.12*inch))
-    else:
-        story.append(Paragraph("No feedback screenshots uploaded.", styles['NormalText']))
-        story.append(Spacer(1, 0.08*inch))
-
-    # Impact Analysis Report
-    story.append(Paragraph("Impact Analysis Report", styles['SectionTitle']))
-    impact_path = data.get('impact_path')
-    if impact_path:
-        story.append(image_flowable(impact_path))
-        story.append(Spacer(1, 0.12*inch))
-    else:
-        story.append(Paragraph("No impact analysis report uploaded.", styles['NormalText']))
-        story.append(Spacer(1, 0.08*inch))
+            speaker_profile += [image_flowable(sp.get('image_path'), image=images.get(sp.get('image_path'))), Spacer(1, 0.12*inch)]
+
+    def single(path):
+        return [path] if path else []
+
+    # The whole story is built in one list
+    story = [
+        Paragraph(university, styles['HeaderMain']),  # 16pt bold centered
+        *([Paragraph(school, styles['HeaderSub'])] if school else []),
+        *([Paragraph(department, styles['HeaderSub'])] if department else []),
+        Spacer(1, 0.2*inch),
+        Paragraph("Activity Report", styles['ReportTitle']),
+
+        Paragraph("General Information", styles['SectionTitle']),
+        *make_table_from_dict(data.get('general_info', {})),
+
+        Paragraph("Speaker/Guest/Presenter Details", styles['SectionTitle']),
+        *make_table_from_dict(data.get('speaker_details', {})),
+
+        Paragraph("Participants Profile", styles['SectionTitle']),
+        *make_table_from_dict(data.get('participants_profile', {})),
+
+        Paragraph("Synopsis of the Activity (Description)", styles['SectionTitle']),
+        *make_table_from_dict(synopsis_table),
+
+        Paragraph("Report Prepared By", styles['SectionTitle']),
+        *make_table_from_dict(data.get('report_prepared_by', {})),
+
+        *speaker_profile,
+
+        *image_section("Photos of the Activity", data.get('photos', {}).get('image_paths', []),
+                       "No photos provided.", images),
+
+        # Attendance List (neat table)
+        Paragraph("Attendance List", styles['SectionTitle']),
+        *participant_table(data.get('attendance', [])),
+
+        *image_section("Flyer of the Event", single(data.get('flyer_path')),
+                       "No flyer uploaded.", images),
+        *image_section("Approval Letter", single(data.get('approval_path')),
+                       "No approval letter uploaded.", images),
+        # Feedback Screenshots (placed before Impact Analysis)
+        *image_section("Feedback Screenshots", data.get('feedback_screenshots', []),
+                       "No feedback screenshots uploaded.", images),
+        *image_section("Impact Analysis Report", single(data.get('impact_path')),
+                       "No impact analysis report uploaded.", images),
+    ]
 
     # Build PDF
     doc.build(story)
-    pdf = buf.getvalue()
-    buf.close()
-    return pdf